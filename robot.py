@@ -6,15 +6,144 @@ Connects to a CopperHead server and plays the game using AI.
 """
 
 import asyncio
-import json
 import argparse
-import websockets
-from collections import deque
+import heapq
+import random
+import orjson
+from picows import WSFrame, WSListener, WSMsgType, WSTransport, ws_connect
+
+try:
+    import uvloop  # Faster event loop; not available on Windows
+except ImportError:
+    uvloop = None
 
 # Game constants (must match server)
 GRID_WIDTH = 30
 GRID_HEIGHT = 20
 
+# Possible moves as (direction, dx, dy)
+_DIRS = (("up", 0, -1), ("down", 0, 1), ("left", -1, 0), ("right", 1, 0))
+
+# Can't reverse
+_OPP = {"up": "down", "down": "up", "left": "right", "right": "left"}
+
+# Bound once so the scoring loop skips the attribute lookups
+_rand = random.random
+_randint = random.randint
+
+# Single-bit mask for each cell of the danger bitmask, indexed by y * GRID_WIDTH + x.
+# Testing with `mask & bit` avoids `mask >> idx`, which builds a large int for low indices
+_CELL_BITS = tuple(1 << i for i in range(GRID_WIDTH * GRID_HEIGHT))
+
+
+def _cell_neighbors(x: int, y: int) -> tuple:
+    """Return the in-bounds neighbor cell indices of a cell (up, down, left, right order)."""
+    neighbors = []
+    for _, dx, dy in _DIRS:
+        nx, ny = x + dx, y + dy
+        if 0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT:
+            neighbors.append(ny * GRID_WIDTH + nx)
+    return tuple(neighbors)
+
+
+# Neighbor cell indices for each cell, indexed by y * GRID_WIDTH + x
+_NEIGHBORS = tuple(_cell_neighbors(x, y)
+                   for y in range(GRID_HEIGHT) for x in range(GRID_WIDTH))
+
+# Direction of a single step, keyed by the change in cell index
+_STEP_DIRS = {dy * GRID_WIDTH + dx: direction for direction, dx, dy in _DIRS}
+
+# Distance to the nearest wall for each cell, indexed by y * GRID_WIDTH + x
+_EDGE_LUT = tuple(min(x, GRID_WIDTH - 1 - x, y, GRID_HEIGHT - 1 - y)
+                  for y in range(GRID_HEIGHT) for x in range(GRID_WIDTH))
+
+
+def is_safe(x: int, y: int, danger: int) -> bool:
+    """Check if position is safe (not wall, not snake)."""
+    return (0 <= x < GRID_WIDTH and 0 <= y < GRID_HEIGHT
+            and not danger & _CELL_BITS[y * GRID_WIDTH + x])
+
+
+def reachable_area(x: int, y: int, danger: int, cap: int) -> int:
+    """Count the open cells reachable from a position, stopping at cap."""
+    start = y * GRID_WIDTH + x
+    visited = danger | _CELL_BITS[start]
+    stack = [start]
+    count = 0
+    while stack and count < cap:
+        count += 1
+        for n_idx in _NEIGHBORS[stack.pop()]:
+            if not visited & _CELL_BITS[n_idx]:
+                visited |= _CELL_BITS[n_idx]
+                stack.append(n_idx)
+    return count
+
+
+def astar(start, goal, danger: int) -> str | None:
+    """Find the shortest path from start to goal around dangerous cells.
+    
+    Returns the direction of the first step, or None if the goal can't be reached.
+    """
+    sx, sy = start
+    gx, gy = goal
+    start_idx = sy * GRID_WIDTH + sx
+    goal_idx = gy * GRID_WIDTH + gx
+    if start_idx == goal_idx or danger & _CELL_BITS[goal_idx]:
+        return None
+    
+    open_list = [(abs(sx - gx) + abs(sy - gy), 0, start_idx)]
+    came_from = {start_idx: None}
+    g_score = {start_idx: 0}
+    closed = 0
+    
+    while open_list:
+        _, g, idx = heapq.heappop(open_list)
+        if idx == goal_idx:
+            # Walk back to the cell next to start
+            while came_from[idx] != start_idx:
+                idx = came_from[idx]
+            return _STEP_DIRS[idx - start_idx]
+        if closed & _CELL_BITS[idx]:
+            continue
+        closed |= _CELL_BITS[idx]
+        blocked = danger | closed
+        
+        for n_idx in _NEIGHBORS[idx]:
+            if blocked & _CELL_BITS[n_idx]:
+                continue
+            new_g = g + 1
+            if new_g < g_score.get(n_idx, new_g + 1):
+                g_score[n_idx] = new_g
+                came_from[n_idx] = idx
+                ny, nx = divmod(n_idx, GRID_WIDTH)
+                heapq.heappush(open_list, (new_g + abs(nx - gx) + abs(ny - gy), new_g, n_idx))
+    
+    return None
+
+
+class RobotListener(WSListener):
+    """Dispatches incoming WebSocket frames to a RobotPlayer."""
+    
+    def __init__(self, robot: "RobotPlayer"):
+        self.robot = robot
+    
+    def on_ws_connected(self, transport: WSTransport):
+        # Frames can arrive before ws_connect() returns, so hand over the transport here
+        self.robot.ws = transport
+    
+    def on_ws_frame(self, transport: WSTransport, frame: WSFrame):
+        # The server sends each JSON message as a single unfragmented frame.
+        # PING is answered by picows itself (enable_auto_pong defaults to on).
+        if frame.msg_type in (WSMsgType.TEXT, WSMsgType.BINARY):
+            try:
+                self.robot.handle_message(orjson.loads(frame.get_payload_as_bytes()))
+            except Exception as e:
+                print(f"❌ Error: {e}")
+                transport.disconnect()
+        elif frame.msg_type == WSMsgType.CLOSE:
+            transport.send_close(frame.get_close_code(), frame.get_close_message())
+            transport.disconnect()
+
 
 class RobotPlayer:
     """Autonomous player that connects to CopperHead server and plays using AI."""
@@ -23,11 +152,23 @@ class RobotPlayer:
         self.server_url = server_url
         self.difficulty = max(1, min(10, difficulty))
         self.player_id = None
+        self._my_key = None
         self.game_state = None
-        self.running = False
+        self.ws = None
         self.wins = 0
         self.games_played = 0
         self.room_id = None
+        self._ready_timer = None
+        # Outgoing messages are fixed, so serialize them once
+        self._move_frames = {
+            d: orjson.dumps({"action": "move", "direction": d})
+            for d in ("up", "down", "left", "right")
+        }
+        self._ready_frame = orjson.dumps({
+            "action": "ready",
+            "mode": "two_player",
+            "name": f"CopperBot L{self.difficulty}"
+        })
         
     async def connect(self):
         """Connect to the game server using auto-matchmaking."""
@@ -39,7 +180,7 @@ class RobotPlayer:
         
         try:
             print(f"🐍 Connecting to {url}...")
-            self.ws = await websockets.connect(url)
+            await ws_connect(lambda: RobotListener(self), url)
             print(f"✅ Connected! Waiting for player assignment...")
             return True
         except Exception as e:
@@ -54,49 +195,38 @@ class RobotPlayer:
                 await asyncio.sleep(3)
                 continue
                 
-            self.running = True
-            
             try:
-                while self.running:
-                    message = await self.ws.recv()
-                    data = json.loads(message)
-                    await self.handle_message(data)
-            except websockets.ConnectionClosed:
+                # Messages are handled by RobotListener as frames arrive
+                await self.ws.wait_disconnected()
                 print("🔌 Connection closed. Reconnecting in 2 seconds...")
-                await asyncio.sleep(2)
-            except Exception as e:
-                print(f"❌ Error: {e}. Reconnecting in 2 seconds...")
-                await asyncio.sleep(2)
             finally:
-                self.running = False
-            
-    async def handle_message(self, data: dict):
+                if self._ready_timer:
+                    self._ready_timer.cancel()
+                    self._ready_timer = None
+            await asyncio.sleep(2)
+    
+    def handle_message(self, data: dict):
         """Handle incoming server messages."""
         msg_type = data.get("type")
         
         if msg_type == "joined":
             # Server assigned us a player ID and room
             self.player_id = data.get("player_id")
+            self._my_key = str(self.player_id)
             self.room_id = data.get("room_id")
             print(f"✅ Joined Room {self.room_id} as Player {self.player_id}")
             
             # Send ready message
-            await self.ws.send(json.dumps({
-                "action": "ready",
-                "mode": "two_player",
-                "name": f"CopperBot L{self.difficulty}"
-            }))
+            self.ws.send(WSMsgType.TEXT, self._ready_frame)
             print(f"🎮 Ready! Playing at difficulty {self.difficulty}")
         
         elif msg_type == "state":
             self.game_state = data.get("game")
             if self.game_state and self.game_state.get("running"):
-                direction = self.calculate_move()
+                danger = self.build_danger_mask()
+                direction = self.calculate_move(danger)
                 if direction:
-                    await self.ws.send(json.dumps({
-                        "action": "move",
-                        "direction": direction
-                    }))
+                    self.ws.send(WSMsgType.TEXT, self._move_frames[direction])
                     
         elif msg_type == "start":
             print("🚀 Game started!")
@@ -113,24 +243,32 @@ class RobotPlayer:
                 print(f"🤝 Draw! ({self.wins}/{self.games_played} games)")
             
             # Auto-ready for next game
-            await asyncio.sleep(1)
-            await self.ws.send(json.dumps({
-                "action": "ready",
-                "mode": "two_player",
-                "name": f"CopperBot L{self.difficulty}"
-            }))
-            print("🎮 Ready for next game!")
+            self._ready_timer = asyncio.get_running_loop().call_later(1, self.ready_for_next_game)
             
         elif msg_type == "waiting":
             print("⏳ Waiting for opponent...")
     
-    def calculate_move(self) -> str | None:
+    def ready_for_next_game(self):
+        """Send the ready message after a game ends."""
+        self._ready_timer = None
+        self.ws.send(WSMsgType.TEXT, self._ready_frame)
+        print("🎮 Ready for next game!")
+    
+    def build_danger_mask(self) -> int:
+        """Build a bitmask of all snake body cells, one bit per cell at y * GRID_WIDTH + x."""
+        mask = 0
+        for snake_data in self.game_state.get("snakes", {}).values():
+            for segment in snake_data.get("body", []):
+                mask |= _CELL_BITS[segment[1] * GRID_WIDTH + segment[0]]
+        return mask
+    
+    def calculate_move(self, dangerous: int) -> str | None:
         """Calculate the best move using AI logic. Prioritizes survival."""
         if not self.game_state:
             return None
             
         snakes = self.game_state.get("snakes", {})
-        my_snake = snakes.get(str(self.player_id))
+        my_snake = snakes.get(self._my_key)
         
         if not my_snake or not my_snake.get("body"):
             return None
@@ -138,89 +276,73 @@ class RobotPlayer:
         head = my_snake["body"][0]
         current_dir = my_snake.get("direction", "right")
         food = self.game_state.get("food")
+        have_food = bool(food)
+        fx, fy = food if have_food else (0, 0)
         
-        # Build set of dangerous positions (all snake bodies)
-        dangerous = set()
-        for snake_data in snakes.values():
-            for segment in snake_data.get("body", []):
-                dangerous.add((segment[0], segment[1]))
-        
-        # Possible moves
-        directions = {
-            "up": (0, -1),
-            "down": (0, 1),
-            "left": (-1, 0),
-            "right": (1, 0)
-        }
-        
-        # Can't reverse
-        opposites = {"up": "down", "down": "up", "left": "right", "right": "left"}
-        
-        def is_safe(x, y):
-            """Check if position is safe (not wall, not snake)."""
-            if x < 0 or x >= GRID_WIDTH or y < 0 or y >= GRID_HEIGHT:
-                return False
-            if (x, y) in dangerous:
-                return False
-            return True
-        
-        def count_safe_neighbors(x, y):
-            """Count how many safe moves are available from a position."""
-            count = 0
-            for dx, dy in [(0, -1), (0, 1), (-1, 0), (1, 0)]:
-                nx, ny = x + dx, y + dy
-                if is_safe(nx, ny):
-                    count += 1
-            return count
+        banned = _OPP.get(current_dir)
         
         # First pass: find all safe moves
         safe_moves = []
-        for direction, (dx, dy) in directions.items():
-            if direction == opposites.get(current_dir):
+        for direction, dx, dy in _DIRS:
+            if direction == banned:
                 continue
             new_x = head[0] + dx
             new_y = head[1] + dy
-            if is_safe(new_x, new_y):
+            if is_safe(new_x, new_y, dangerous):
                 safe_moves.append({"direction": direction, "x": new_x, "y": new_y})
         
         # If no safe moves, pick any non-reversing move (we're doomed)
         if not safe_moves:
-            for direction in directions:
-                if direction != opposites.get(current_dir):
+            for direction, _, _ in _DIRS:
+                if direction != banned:
                     return direction
             return current_dir
         
+        # Only one way to go, no need to score it
+        if len(safe_moves) == 1:
+            return safe_moves[0]["direction"]
+        
+        my_length = len(my_snake["body"])
+        
+        # Expert play: follow the shortest path to food when there is one,
+        # unless its first step leads into a pocket too small to fit us
+        if have_food and self.difficulty >= 9:
+            path_dir = astar(head, food, dangerous)
+            for move in safe_moves:
+                if (move["direction"] == path_dir and
+                        reachable_area(move["x"], move["y"], dangerous, my_length) >= my_length):
+                    return path_dir
+        
         # Evaluate safe moves
         best_dir = None
         best_score = float('-inf')
+        mistake_chance = (10 - self.difficulty) / 20
         
         for move in safe_moves:
             score = 0
             new_x, new_y = move["x"], move["y"]
             
             # Big bonus for capturing food
-            if food and new_x == food[0] and new_y == food[1]:
-                score += 1000  # Always prioritize eating
+            if have_food and new_x == fx and new_y == fy:
+                score += 1000  # Prioritize eating
             
-            # Prioritize moves that don't trap us (have escape routes)
-            escape_routes = count_safe_neighbors(new_x, new_y)
-            score += escape_routes * 50  # Important but not more than food
+            # Prioritize moves that don't trap us (have room to move). For long
+            # snakes this can outweigh food, so we won't eat our way into a pocket
+            reachable = reachable_area(new_x, new_y, dangerous, my_length)
+            score += reachable * 30
             
             # Distance to food (closer is better)
-            if food:
-                food_dist = abs(new_x - food[0]) + abs(new_y - food[1])
+            if have_food:
+                food_dist = abs(new_x - fx) + abs(new_y - fy)
                 score += (GRID_WIDTH + GRID_HEIGHT - food_dist) * 10
             
             # Prefer staying away from edges
-            edge_dist = min(new_x, GRID_WIDTH - 1 - new_x, 
-                           new_y, GRID_HEIGHT - 1 - new_y)
+            edge_dist = _EDGE_LUT[new_y * GRID_WIDTH + new_x]
             score += edge_dist * 5
             
             # Random factor based on difficulty (lower = more random)
-            import random
-            mistake_chance = (10 - self.difficulty) / 20
-            if random.random() < mistake_chance:
-                score -= random.randint(0, 30)
+            if _rand() < mistake_chance:
+                score -= _randint(0, 30)
             
             if score > best_score:
                 best_score = score
@@ -247,4 +369,7 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())